@@ -13,6 +13,10 @@ from __future__ import division
 from __future__ import absolute_import
 from future import standard_library
 standard_library.install_aliases()
+import os
+import shutil
+import zipfile
+import tempfile
 from unittester import *
 from vckube import *
 
@@ -21,12 +25,101 @@ class K8svpTestCase(unittest.TestCase):
     """
     """
 
+    def setUp(self):
+        """
+        setUp
+        """
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        self.workdir = os.path.join(self.tmpdir, "project")
+        os.mkdir(self.workdir)
+        os.chdir(self.workdir)
+
+    def tearDown(self):
+        """
+        tearDown
+        """
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
     def test_command(self):
         """
         test_assert_raises
         """
         pass
 
+    def test_hosts_inventory(self):
+        """
+        test_hosts_inventory
+        """
+        footer = "[all_groups:children]\nmasters\netcd\nnodes\n\n" \
+                 "[coreos]\n{names}\n" \
+                 "[coreos:vars]\nansible_ssh_user=core\nansible_python_interpreter=\"PATH=/home/core/bin:$PATH python\"\n"
+
+        expected = "\n[masters]\n" \
+                   "\n[etcd]\n" \
+                   "\n[nodes]\n" \
+                   "\n[all]\n\n" + footer.format(names="")
+        self.assertEqual(hosts_inventory([], []), expected)
+
+        expected = "node1 ansible_ssh_host=192.168.14.51 ansible_ssh_port=22\n" \
+                   "\n[masters]\nnode1\n" \
+                   "\n[etcd]\n" \
+                   "\n[nodes]\n" \
+                   "\n[all]\nnode1\n\n" + footer.format(names="node1\n")
+        self.assertEqual(hosts_inventory(["node1"], ["192.168.14.51"]), expected)
+
+        expected = "node1 ansible_ssh_host=192.168.14.51 ansible_ssh_port=22\n" \
+                   "node2 ansible_ssh_host=192.168.14.52 ansible_ssh_port=22\n" \
+                   "node3 ansible_ssh_host=node3.a8.nl ansible_ssh_port=22\n" \
+                   "\n[masters]\nnode1\n" \
+                   "\n[etcd]\nnode2\n" \
+                   "\n[nodes]\nnode2\nnode3\n" \
+                   "\n[all]\nnode1\nnode2\nnode3\n\n" + footer.format(names="node1\nnode2\nnode3\n")
+        self.assertEqual(hosts_inventory(["node1", "node2", "node3"], ["192.168.14.51", "192.168.14.52", "node3.a8.nl"]), expected)
+
+    def test_num_instances(self):
+        """
+        test_num_instances
+        """
+        to_file("Vagrantfile", "$update_channel = 'alpha'\n$num_instances = 3\n(1..$num_instances).each do |i|\n")
+        self.assertEqual(get_num_instances(), 3)
+        to_file("Vagrantfile", "$num_instances=12\n")
+        self.assertEqual(get_num_instances(), 12)
+
+        # the placeholder in Vagrantfile.tpl.rb and a missing setting both give None
+        to_file("Vagrantfile", "$num_instances = x\n")
+        self.assertIsNone(get_num_instances())
+        to_file("Vagrantfile", "$vm_memory = 1024\n")
+        self.assertIsNone(get_num_instances())
+
+    def test_unzip(self):
+        """
+        test_unzip
+        """
+        with zipfile.ZipFile("master.zip", "w") as zf:
+            zf.writestr("vckube-createproject-master/", "")
+            zf.writestr("vckube-createproject-master/Vagrantfile.tpl.rb", "$num_instances = x\n")
+            zf.writestr("vckube-createproject-master/config/tokenosx.txt", "token")
+
+        unzip("master.zip")
+        self.assertEqual(cat("Vagrantfile.tpl.rb"), "$num_instances = x\n")
+        self.assertEqual(cat("config/tokenosx.txt"), "token")
+        self.assertFalse(os.path.exists("vckube-createproject-master"))
+
+    def test_unzip_rejects_traversal(self):
+        """
+        test_unzip_rejects_traversal
+        """
+        with zipfile.ZipFile("master.zip", "w") as zf:
+            zf.writestr("vckube-createproject-master/Vagrantfile.tpl.rb", "")
+            zf.writestr("vckube-createproject-master/../../evil.txt", "evil")
+
+        self.assertRaises(AssertionError, unzip, "master.zip")
+        self.assertFalse(os.path.exists("Vagrantfile.tpl.rb"))
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "evil.txt")))
+        self.assertFalse(os.path.exists(os.path.join(os.path.dirname(self.tmpdir), "evil.txt")))
+
     # remote_cmd(server, cmd):
     # def run_cmd(cmd, pr=False, shell=False, streamoutput=True, returnoutput=False):
     #     def scp(server, cmdtype, fp1, fp2):
@@ -7,25 +7,162 @@ from __future__ import division, print_function, absolute_import, unicode_litera
 
 import os
 import re
+import sys
 import json
 import stat
 import time
+import shlex
+import atexit
 import pickle
 import shutil
 import socket
-import vagrant
-import zipfile
+import hashlib
+import paramiko
 import platform
-import netifaces
+import functools
+import threading
 import subprocess
+import http.client
+import http.server
+import urllib.request
 import concurrent.futures
 
 from os import path
 from tempfile import NamedTemporaryFile
 from arguments import Use, abort, Schema, abspath, BaseArguments, delete_directory
-from cmdssh import shell, cmd_run, scp_run, cmd_exec, download, remote_cmd, invoke_shell, remote_cmd_map, CallCommandException
+from cmdssh import shell, cmd_run, cmd_exec, download, invoke_shell, CallCommandException
 from consoleprinter import Info, info, console, doinput, warning, clear_screen, query_yes_no, console_warning, console_exception, colorize_for_print, console_error_exit
 
+DISCOVERY_CONNECTIONS = {}
+IS_DARWIN = sys.platform == "darwin"
+KUBECTL_PATHS = {}
+NUM_INSTANCES_RE = re.compile(r"num_instances\s*=\s*(\d+)")
+REMOTE_SESSIONS = {}
+REMOTE_SESSIONS_LOCK = threading.Lock()
+SSH_KEYS_ADDED = set()
+# thread pool size for per vm ssh work, one connection per vm and network bound so threads instead of processes
+SSH_WORKERS = 8
+SSH_CONFIG_HOST_RE = re.compile(r"^Host ", re.MULTILINE)
+VERSION_INFO_KEY_RE = re.compile(r"([{,]\s*)(\w+):")
+VMNAMES_CACHE = {}
+STATUS_SPLIT = "---VCKUBE_SPLIT---"
+SYSTEMCTL_UNITS_CMD = r"systemctl list-units | sed 's/loaded//' | sed 's/LOAD  //' | sed 's/[\d128-\d255]//g'"
+HOSTS_TEMPLATE = """{hostlines}
+[masters]
+{masters}
+[etcd]
+{etcd}
+[nodes]
+{nodes}
+[all]
+{names}
+[all_groups:children]
+masters
+etcd
+nodes
+
+[coreos]
+{names}
+[coreos:vars]
+ansible_ssh_user=core
+ansible_python_interpreter="PATH=/home/core/bin:$PATH python"
+"""
+
+
+class RemoteSession(object):
+    """
+    Paramiko connection to a server, reused for multiple commands and uploads
+    """
+    def __init__(self, server, username="core", keypath=None):
+        """
+        @type server: str
+        @type username: str
+        @type keypath: list, str, None
+        @return: None
+        """
+        self.server = server
+        self.username = username
+        self.keypath = keypath
+        self.client = None
+        self.sftp = None
+
+    def __enter__(self):
+        """
+        @return: RemoteSession
+        """
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """
+        @type exc_type: type, None
+        @type exc_val: BaseException, None
+        @type exc_tb: traceback, None
+        @return: None
+        """
+        self.close()
+
+    def close(self):
+        """
+        close
+        """
+        if self.sftp is not None:
+            self.sftp.close()
+            self.sftp = None
+
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    def connect(self, timeout=60):
+        """
+        @type timeout: int
+        @return: None
+        """
+        if self.client is not None:
+            transport = self.client.get_transport()
+
+            if transport is not None and transport.is_active():
+                return
+
+            self.close()
+
+        client = paramiko.SSHClient()
+        client.load_system_host_keys()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(self.server, username=self.username, timeout=timeout, key_filename=self.keypath, compress=True)
+        self.client = client
+
+    def put(self, fp1, fp2):
+        """
+        @type fp1: str
+        @type fp2: str
+        @return: None
+        """
+        self.connect()
+
+        if self.sftp is None:
+            self.sftp = self.client.open_sftp()
+
+        self.sftp.put(fp1, fp2)
+
+    def run(self, cmd, timeout=60):
+        """
+        @type cmd: str
+        @type timeout: int (connect timeout)
+        @return: str
+        """
+        self.connect(timeout)
+        si, so, se = self.client.exec_command(cmd)
+        so = so.read()
+        se = se.read()
+
+        if len(se) > 0:
+            se = se.decode("utf-8").strip()
+            console(se.replace("\n", "\n     | "), color="red")
+
+        return so.decode("utf-8")
+
 
 class VagrantArguments(BaseArguments):
     """
@@ -46,8 +183,10 @@ class VagrantArguments(BaseArguments):
         self.command = ""
         self.createproject = None
         self.parallel = False
+        self.refreshcluster = False
         self.wait = 0
         self.projectname = ""
+        self.vmnames = None
         doc = """
             Vagrant cluster management by Active8 NL
             erik@a8.nl
@@ -60,6 +199,7 @@ class VagrantArguments(BaseArguments):
                 -p --parallel           Execute commands in parallel, default is serial execution
                 -v --verbose            Verbose mode.
                 -f --force              Do not ask for confirmation
+                -r --refreshcluster     Ignore cached vagrant ssh-config data.
                 -w --wait=<ws>          Wait <ws> seconds between commands.
                 -d --workingdir=<wrkd>  Directory to execute commands in, default is current working dir.
 
@@ -131,6 +271,42 @@ def cat(fpath, mode="rt"):
         return f.read()
 
 
+def cat_cached(fpath, mode="rt"):
+    """
+    cat, the content is kept in memory until the mtime or size of the file changes,
+    only for templates (*.tmpl.yml, *.tpl.rb), generated files are rewritten with the same size
+    @type fpath: str
+    @type mode: str
+    @return: str, bytes
+    """
+    fpath = os.path.abspath(fpath)
+    st = os.stat(fpath)
+    return cat_version(fpath, st.st_mtime_ns, st.st_size, mode)
+
+
+@functools.lru_cache(maxsize=32)
+def cat_version(fpath, mtime_ns, size, mode):
+    """
+    @type fpath: str
+    @type mtime_ns: int
+    @type size: int
+    @type mode: str
+    @return: str, bytes
+    """
+    return cat(fpath, mode)
+
+
+def close_remote_sessions():
+    """
+    close_remote_sessions
+    """
+    with REMOTE_SESSIONS_LOCK:
+        for session in REMOTE_SESSIONS.values():
+            session.close()
+
+        REMOTE_SESSIONS.clear()
+
+
 def cmd_ansible(commandline):
     """
     @type commandline: VagrantArguments
@@ -144,27 +320,22 @@ def cmd_ansible(commandline):
         if ":" not in serverplaybook:
             serverplaybook = "all:" + serverplaybook
 
-        spb = serverplaybook.split(":")
-
-        if len(spb) == 2:
-            playbook = os.path.abspath(os.path.expanduser(spb[1]))
-            server = spb[0].strip()
-        elif len(spb) == 2:
-            playbook = os.path.abspath(os.path.expanduser(spb[1]))
-            server = spb[0].strip()
-            password = spb[2].strip()
+        spb = serverplaybook.split(":", 2)
+        server = spb[0].strip()
+        playbook = os.path.abspath(os.path.expanduser(spb[1]))
+        password = spb[2].strip() if len(spb) == 3 else None
 
     if playbook and os.path.exists(playbook):
         info(commandline.command, "playbook found at " + playbook)
     else:
-        warning(commandline.command, "no playbook found at " + playbook)
+        warning(commandline.command, "no playbook found at " + str(playbook))
 
     if server is None:
         abort(commandline.command, "server is None")
     elif playbook is None:
         abort(commandline.command, "playbook is None")
 
-    cmd_provision_ansible(server, playbook, password)
+    cmd_provision_ansible(commandline, server, playbook, password)
 
 
 def cmd_baseprovision(commandline, provider):
@@ -173,29 +344,26 @@ def cmd_baseprovision(commandline, provider):
     @type provider: str
     @return: None
     """
-    try:
-        shell("ssh-add keys/insecure/vagrant")
-    except BaseException as ex:
-        console(ex)
-
+    ensure_ssh_key("keys/insecure/vagrant")
     info(commandline.command, "make directories on server")
     cmd_up(commandline, provider)
-    cmd_remote_command("sudo mkdir /root/pypy&&sudo ln -s /home/core/bin /root/pypy/bin;", commandline.parallel, keypath=get_keypaths())
+    cmd_remote_command(commandline, "sudo mkdir /root/pypy&&sudo ln -s /home/core/bin /root/pypy/bin;", commandline.parallel, keypath=get_keypaths())
     info(commandline.command, "install python container on server")
-    cmd_provision_ansible("all", "./playbooks/ansiblebootstrap.yml", None)
+    cmd_provision_ansible(commandline, "all", "./playbooks/ansiblebootstrap.yml", None)
     keypath = os.path.join(os.getcwd(), "keys/secure/vagrantsecure")
     generate_keypair(commandline.command, "core user vagrant", keypath)
-    cmd_provision_ansible("all", "./playbooks/keyswap.yml", None)
+    cmd_provision_ansible(commandline, "all", "./playbooks/keyswap.yml", None)
     cmd_reset(commandline, commandline.wait)
 
 
-def cmd_connect_ssh(server):
+def cmd_connect_ssh(commandline, server):
     """
+    @type commandline: VagrantArguments
     @type server: str
     @return: None
     """
     cnt = 0
-    vmnames = get_vm_names()
+    vmnames = get_vm_names_cached(commandline)
     index = 1
 
     if server not in vmnames:
@@ -203,47 +371,45 @@ def cmd_connect_ssh(server):
             index = int(server)
         except ValueError:
             index = None
-    try:
-        cmd_run("ssh-add keys/secure/vagrantsecure")
-    except BaseException as ex:
-        console(ex)
-    try:
-        cmd_run("ssh-add keys/insecure/vagrant")
-    except BaseException as ex:
-        console(ex)
+    ensure_ssh_key("keys/secure/vagrantsecure")
+    ensure_ssh_key("keys/insecure/vagrant")
 
     if server == "all" or server not in vmnames and index is not None:
+        targets = []
+
         for name in vmnames:
             cnt += 1
 
             if server == "all" or index == cnt:
-                info("ssh", name)
+                targets.append(name)
+
+        sshoptions = ensure_ssh_controlmaster(targets)
 
-                while True:
+        for name in targets:
+            info("ssh", name)
+
+            while True:
+                try:
                     try:
-                        try:
-                            rv = shell("ssh core@" + name + ".a8.nl")
-
-                            if rv == 255:
-                                info(name, "waiting")
-                                time.sleep(1)
-                            else:
-                                if rv != 0:
-                                    info("exit", rv)
-                                break
-                        except BaseException as ex:
-                            warning(name, str(ex))
-                            if invoke_shell(name + ".a8.nl", "core", get_keypaths()) != 0:
-                                print("connection lost, trying in 1 seconds (ctrl-c to quit)")
-                                time.sleep(1)
-                            else:
-                                break
+                        rv = shell("ssh " + sshoptions + " core@" + name + ".a8.nl")
 
-                    except KeyboardInterrupt:
-                        info("connect_ssh", "bye")
-                        break
+                        if rv == 255:
+                            info(name, "waiting")
+                            time.sleep(1)
+                        else:
+                            if rv != 0:
+                                info("exit", rv)
+                            break
+                    except BaseException as ex:
+                        warning(name, str(ex))
+                        if invoke_shell(name + ".a8.nl", "core", get_keypaths()) != 0:
+                            print("connection lost, trying in 1 seconds (ctrl-c to quit)")
+                            time.sleep(1)
+                        else:
+                            break
 
-                if server != 'all':
+                except KeyboardInterrupt:
+                    info("connect_ssh", "bye")
                     break
     else:
         if server in vmnames:
@@ -275,10 +441,12 @@ def pickle_save(commandline, name, o):
     dirname = os.path.dirname(ppath)
 
     if len(dirname) > 0:
-        if not os.path.exists(dirname):
-            os.makedirs(dirname, exist_ok=True)
+        os.makedirs(dirname, exist_ok=True)
 
-    pickle.dump(o, open(ppath, "wb"))
+    with open(ppath, "wb") as f:
+        pickle.dump(o, f, pickle.HIGHEST_PROTOCOL)
+
+    pickle_load_cached.cache_clear()
 
 
 def pickle_load(commandline, name):
@@ -287,14 +455,26 @@ def pickle_load(commandline, name):
     @type name: str
     @return: dict, list, int, float
     """
-    info(commandline.command, "saving pickle " + str(name))
-    picklepath = os.path.join(str(commandline.workingdir), ".vckube")
+    info(commandline.command, "loading pickle " + str(name))
+    return pickle_load_cached(str(commandline.workingdir), name)
+
+
+@functools.lru_cache(maxsize=None)
+def pickle_load_cached(workingdir, name):
+    """
+    pickle_load without reading the file again, pickle_save clears the cache
+    @type workingdir: str
+    @type name: str
+    @return: dict, list, int, float
+    """
+    picklepath = os.path.join(workingdir, ".vckube")
     ppath = os.path.join(picklepath, name)
 
     if not os.path.exists(ppath):
         raise FileExistsError(ppath)
 
-    return pickle.load(open(ppath, "rb"))
+    with open(ppath, "rb") as f:
+        return pickle.load(f)
 
 
 def cmd_createproject(commandline):
@@ -335,7 +515,9 @@ def cmd_createproject_driver(commandline, name, project_found):
     if project_found:
         abort(commandline.command, "project file exist [" + str(name) + "], refusing overwrite")
     try:
+        commandline.vmnames = None
         cmd_createproject(commandline)
+        commandline.vmnames = None
         cmd_run("vagrant halt")
     except BaseException as be:
         abort(commandline.command, str(be))
@@ -351,21 +533,29 @@ def cmd_createproject_driver(commandline, name, project_found):
             print(cce)
 
 
-def cmd_destroy_vagrant_cluster():
+def cmd_destroy_vagrant_cluster(commandline):
     """
-    destroy_vagrant_cluster
+    @type commandline: VagrantArguments
+    @return: None
     """
     cwd = os.getcwd()
+    commandline.vmnames = None
 
     try:
         cmd = "vagrant destroy -f"
         cmd_run(cmd)
 
-        for vmx in str(os.popen("vmrun list")):
-            if ".vmx" in vmx:
-                vmx = vmx.strip()
-                cmd_run("vmrun stop " + vmx + " > /dev/null &")
-                cmd_run("vmrun deleteVM " + vmx + " > /dev/null &")
+        try:
+            vmrunlist = subprocess.run(["vmrun", "list"], stdout=subprocess.PIPE, universal_newlines=True).stdout
+        except FileNotFoundError:
+            vmrunlist = ""
+
+        vmxs = [vmx.strip() for vmx in vmrunlist.splitlines() if vmx.strip().endswith(".vmx")]
+        results = run_parallel(["vmrun stop " + shlex.quote(vmx) + "; vmrun deleteVM " + shlex.quote(vmx) for vmx in vmxs])
+
+        for vmx, (code, output) in zip(vmxs, results):
+            if code != 0:
+                warning("vmrun deleteVM " + vmx, "code " + str(code) + " " + output)
 
     finally:
         os.chdir(os.path.dirname(cwd))
@@ -418,11 +608,11 @@ def cmd_driver_vagrant(commandline):
     elif commandline.command == "coreostoken":
         cmd_print_coreos_token_stdout()
     elif commandline.command == "destroy":
-        cmd_destroy_vagrant_cluster()
+        cmd_destroy_vagrant_cluster(commandline)
     elif commandline.command == "reload":
         cmd_run("vagrant reload")
     elif commandline.command == "reboot":
-        cmd_remote_command("sudo reboot", True, timeout=5, keypath=get_keypaths())
+        cmd_remote_command(commandline, "sudo reboot", True, timeout=5, keypath=get_keypaths())
     elif commandline.command == "status":
         print("\033[91mcluster machines:\033[0m")
         cmd_statuscluster(commandline)
@@ -431,10 +621,16 @@ def cmd_driver_vagrant(commandline):
         commandline.args = ["get", "all"]
         cmd_kubectl(commandline)
     elif commandline.command == "reset":
-        removelist = ["user-data" + str(x) + ".yml" for x in range(1, get_num_instances() + 1)]
+        removelist = ["user-data" + str(x) + ".yml" for x in range(1, (get_num_instances() or 0) + 1)]
         removelist.extend(["master.yml", "node.yml"])
         removelist = [os.path.join(os.path.join(commandline.workingdir, "configscripts"), x) for x in removelist]
-        [os.remove(x) for x in removelist if os.path.exists(x)]
+
+        for x in removelist:
+            try:
+                os.remove(x)
+            except FileNotFoundError:
+                pass
+
         set_gateway_and_coreostoken(commandline)
         cmd_reset(commandline, commandline.wait)
     elif commandline.command == "ansible":
@@ -443,7 +639,7 @@ def cmd_driver_vagrant(commandline):
         provider = get_provider()
         cmd_baseprovision(commandline, provider)
         password = doinput("testansible password", default="")
-        cmd_provision_ansible("all", "./playbooks/testansible.yml", password)
+        cmd_provision_ansible(commandline, "all", "./playbooks/testansible.yml", password)
     elif commandline.command == "ssh":
         cmd_ssh(commandline)
     elif commandline.command == "sshcmd":
@@ -460,30 +656,7 @@ def cmd_kubectl(commandline):
     @type commandline: VagrantArguments
     @return: None
     """
-    machine = platform.machine()
-
-    if "64" in str(machine):
-        machine = "amd64"
-    else:
-        machine = "386"
-
-    system = platform.system()
-    kubectl = os.path.join(commandline.workingdir, "platforms")
-    kubectl = os.path.join(kubectl, system.lower())
-    kubectl = os.path.join(kubectl, machine)
-    kubectl = os.path.join(kubectl, "kubectl")
-
-    if not os.path.exists(kubectl):
-        os.makedirs(os.path.dirname(kubectl), exist_ok=True)
-        download("https://storage.googleapis.com/kubernetes-release/release/v0.15.0/bin/darwin/amd64/kubectl", kubectl)
-
-    if not os.path.exists(kubectl):
-        abort(commandline.command, "kubectl not found: " + str(kubectl))
-
-    if not os.access(kubectl, os.X_OK):
-        info("cmd_kubectl:chmod:exec", kubectl)
-        os.chmod(kubectl, stat.S_IREAD | stat.S_IWRITE | stat.S_IEXEC)
-
+    kubectl = get_kubectl(commandline)
     kubectl += " --server="
     vmhostosx = is_osx()
 
@@ -544,10 +717,18 @@ def cmd_kubectl(commandline):
                 if i == "all":
                     execute = False
                     myall = True
+                    results = run_parallel([kubectl + k for k in reskeys])
 
-                    for cnt, k in enumerate(reskeys):
-                        kubectl1 = kubectl + k
-                        cmd_exec(kubectl1, cmdtoprint="\033[34m" + resources[k] + ":\033[0m", myfilter=filterkubectllog)
+                    for cnt, (k, (code, rv)) in enumerate(zip(reskeys, results)):
+                        if code == 0:
+                            print("\033[34m" + resources[k] + ":\033[0m")
+
+                            for line in rv.split("\n"):
+                                print(colorize_for_print(line))
+                        else:
+                            warning("code", str(code))
+                            warning("cmd", resources[k])
+                            warning("rv", filterkubectllog(rv))
 
                         if cnt < len(reskeys) - 1:
                             print()
@@ -583,8 +764,9 @@ def cmd_print_coreos_token_stdout():
     print("\033[36m" + str(get_token()) + "\033[0m")
 
 
-def cmd_provision_ansible(targetvmname, playbook, password):
+def cmd_provision_ansible(commandline, targetvmname, playbook, password):
     """
+    @type commandline: VagrantArguments
     @type targetvmname: str
     @type playbook: str
     @type password: str, None
@@ -598,10 +780,10 @@ def cmd_provision_ansible(targetvmname, playbook, password):
         f.seek(0)
 
     info("ansible-playbook:", playbook)
-    p = subprocess.Popen(["python", "-m", "SimpleHTTPServer", "8000"], stdout=open("/dev/null", "w"), stderr=open("/dev/null", "w"))
+    httpserver = start_http_server()
     try:
         if path.exists("./hosts"):
-            vmnames = get_vm_names()
+            vmnames = get_vm_names_cached(commandline)
 
             if targetvmname == "all":
                 cmd = "ansible-playbook -u core --inventory-file=" + path.join(os.getcwd(), "hosts") + "  -u core --limit=all " + playbook
@@ -623,12 +805,13 @@ def cmd_provision_ansible(targetvmname, playbook, password):
         else:
             cmd_run("vagrant provision")
     finally:
-        p.kill()
+        stop_http_server(httpserver)
         os.remove(f.name)
 
 
-def cmd_remote_command(command, parallel, wait=0, server=None, timeout=60, keypath=None):
+def cmd_remote_command(commandline, command, parallel, wait=0, server=None, timeout=60, keypath=None):
     """
+    @type commandline: VagrantArguments
     @type command: str
     @type parallel: bool
     @type wait: int
@@ -660,7 +843,7 @@ def cmd_remote_command(command, parallel, wait=0, server=None, timeout=60, keypa
     info(serverinfo, cmdinfo)
 
     if server is None:
-        vmnames = get_vm_names()
+        vmnames = get_vm_names_cached(commandline)
 
         if command not in vmnames:
             commands = []
@@ -671,7 +854,7 @@ def cmd_remote_command(command, parallel, wait=0, server=None, timeout=60, keypa
                 if parallel is True:
                     commands.append((name + '.a8.nl', cmd, 'core', keypath))
                 else:
-                    result = remote_cmd(name + '.a8.nl', cmd, timeout=timeout, username='core', keypath=keypath)
+                    result = get_remote_session(name + '.a8.nl', 'core', keypath).run(cmd, timeout=timeout)
 
                     if result.strip():
                         cmd_remote_command_print_result(name, result)
@@ -691,8 +874,16 @@ def cmd_remote_command(command, parallel, wait=0, server=None, timeout=60, keypa
                         else:
                             time.sleep(float(wait))
 
+            def remote_cmd_map(servercmd):
+                """
+                @type servercmd: tuple
+                @return: tuple
+                """
+                server, cmd, username, keypath = servercmd
+                return server, get_remote_session(server, username, keypath).run(cmd, timeout=timeout)
+
             if len(commands) > 0:
-                with concurrent.futures.ProcessPoolExecutor(max_workers=8) as executor:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=min(SSH_WORKERS, len(commands))) as executor:
                     result = executor.map(remote_cmd_map, commands)
                     lastoutput = ""
 
@@ -703,7 +894,7 @@ def cmd_remote_command(command, parallel, wait=0, server=None, timeout=60, keypa
                             warning(command, server.split(".")[0] + "... done")
     else:
         cmd = command
-        result = remote_cmd(server + '.a8.nl', cmd, username='core', keypath=get_keypaths())
+        result = get_remote_session(server + '.a8.nl', 'core', get_keypaths()).run(cmd)
 
         if result:
             cmd_remote_command_print_result(server, result)
@@ -747,9 +938,12 @@ def cmd_reset(commandline, wait=None):
 
     cmd_run("rm -f " + os.path.join(os.getcwd(), "./configscripts") + "/user-data*")
     info(commandline.command, "replace cloudconfiguration, checking vms are up")
-    p = subprocess.Popen(["/usr/bin/vagrant", "up"], cwd=os.getcwd())
-    p.wait()
-    vmnames = get_vm_names()
+    try:
+        cmd_run("vagrant up --no-provision")
+    except CallCommandException as ex:
+        warning(commandline.command, str(ex))
+
+    vmnames = get_vm_names_cached(commandline)
     knownhosts = path.join(path.join(path.expanduser("~"), ".ssh"), "known_hosts")
 
     if path.exists(knownhosts):
@@ -757,25 +951,29 @@ def cmd_reset(commandline, wait=None):
 
     if len(vmnames) > 0:
         cnt = 1
+        keypaths = get_keypaths()
+        cwd = os.getcwd()
+        configdir = path.join(cwd, "configscripts")
+        logsdir = path.join(cwd, "logs")
+        os.makedirs(logsdir, exist_ok=True)
 
         for name in vmnames:
             info("reset", name + '.a8.nl put configscript')
-            scp_run(server=name + '.a8.nl', cmdtype="put", fp1="configscripts/user-data" + str(cnt) + ".yml", fp2="/tmp/vagrantfile-user-data", username="core", keypath=get_keypaths())
-            cmd = "sudo cp /tmp/vagrantfile-user-data /var/lib/coreos-vagrant/vagrantfile-user-data"
-            remote_cmd(name + '.a8.nl', cmd, username='core', keypath=get_keypaths())
-            info(name, "uploaded config rebooting now")
-            logpath = path.join(os.getcwd(), "logs/" + name + "-serial.txt")
 
-            if path.exists(path.dirname(logpath)):
-                open(logpath, "w").write("")
+            session = get_remote_session(name + '.a8.nl', 'core', keypaths)
+            session.put(path.join(configdir, "user-data" + str(cnt) + ".yml"), "/tmp/vagrantfile-user-data")
+            session.run("sudo cp /tmp/vagrantfile-user-data /var/lib/coreos-vagrant/vagrantfile-user-data")
+            info(name, "uploaded config rebooting now")
+            to_file(path.join(logsdir, name + "-serial.txt"), "")
+            session.run("sudo reboot")
 
-            cmd = "sudo reboot"
-            remote_cmd(name + '.a8.nl', cmd, username='core', keypath=get_keypaths())
+            # the connection drops with the reboot, the next connect() opens a new one
+            session.close()
 
             if wait is not None:
                 if str(wait) == "-1":
                     try:
-                        iquit = eval(input("\n\n---\npress enter to continue (q=quit): "))
+                        iquit = input("\n\n---\npress enter to continue (q=quit): ")
                         if iquit.strip() == "q":
                             break
 
@@ -794,41 +992,31 @@ def cmd_restart_vmware(commandline):
     @type commandline: VagrantArguments
     @return: None
     """
-    osx = is_osx()
+    if is_osx():
+        stopcmd = "sudo vmnet-cli --stop"
+        startcmd = "sudo vmnet-cli --start"
+    else:
+        stopcmd = "sudo /usr/bin/vmware-networks --stop"
+        startcmd = "sudo /usr/bin/vmware-networks --start"
 
-    for cnt in range(1, 15):
+    backoff = 0.25
+
+    for cnt in range(1, 7):
         try:
             if cnt > 2:
                 info(commandline.command, "attempt " + str(cnt))
 
-            if cnt > 4:
-                if osx:
-                    os.system("sudo vmnet-cli --stop")
-                    time.sleep(1)
-                    os.system("sudo vmnet-cli --start")
-                    time.sleep(2)
-                else:
-                    os.system("sudo /usr/bin/vmware-networks --stop")
-                    time.sleep(1)
-                    os.system("sudo /usr/bin/vmware-networks --start")
-                    time.sleep(2)
-
-                if cnt > 6:
-                    break
-            else:
-                if osx:
-                    cmd_run("sudo vmnet-cli --stop")
-                    time.sleep(1)
-                    cmd_run("sudo vmnet-cli --start")
-                    time.sleep(2)
-                else:
-                    cmd_run("sudo /usr/bin/vmware-networks --stop")
-                    time.sleep(1)
-                    cmd_run("sudo /usr/bin/vmware-networks --start")
-                    time.sleep(2)
-                break
+            cmd_run(stopcmd)
+            cmd_run(startcmd)
+            break
         except CallCommandException as ex:
             warning(commandline.command, str(ex) + " attempt " + str(cnt))
+            time.sleep(backoff)
+            backoff *= 2
+    else:
+        # cmd_run kept failing, last attempt without checking the exit codes
+        os.system(stopcmd)
+        os.system(startcmd)
 
 
 def cmd_ssh(commandline):
@@ -845,7 +1033,7 @@ def cmd_ssh(commandline):
         server = str(commandline.args[0])
 
     if server is not None:
-        cmd_connect_ssh(server)
+        cmd_connect_ssh(commandline, server)
 
 
 def cmd_sshcmd(commandline):
@@ -867,7 +1055,7 @@ def cmd_sshcmd(commandline):
             server = cmds[0]
             cmd = cmds[1]
 
-        cmd_remote_command(cmd, commandline.parallel, wait=commandline.wait, server=server, timeout=5, keypath=get_keypaths())
+        cmd_remote_command(commandline, cmd, commandline.parallel, wait=commandline.wait, server=server, timeout=5, keypath=get_keypaths())
     except socket.timeout as ex:
         abort("sshcmd: " + commandline.args[0], "exception -> " + str(ex))
 
@@ -877,43 +1065,55 @@ def cmd_statuscluster(commandline):
     @type commandline: VagrantArguments
     @return: None
     """
-    vmnames = get_vm_names()
+    vmnames = get_vm_names_cached(commandline)
 
-    if len(vmnames) > 0:
-        for cnt, name in enumerate(vmnames):
-            cmd = "vagrant ssh-config " + name
-            try:
-                out = ""
+    if commandline.refreshcluster:
+        sshconfigcache = os.path.join(str(commandline.workingdir), ".vckube/ssh-config.cache")
 
-                if path.exists(".cl/" + name + ".statuscluster"):
-                    out = open(".cl/" + name + ".statuscluster").read()
+        if os.path.exists(sshconfigcache):
+            os.remove(sshconfigcache)
 
-                if len(out.strip()) == 0:
-                    out = cmd_run(cmd, streamoutput=False, returnoutput=True)
-                    out = out.strip()
-                    open(".cl/" + name + ".statuscluster", "wt").write(out)
+    if len(vmnames) > 0:
+        sshconfigs = get_ssh_configs(commandline, vmnames)
+        keypaths = get_keypaths()
 
-                res = ""
+        def probe_host(name):
+            """
+            @type name: str
+            @return: tuple
+            """
+            res = ""
 
-                for row in out.split("\n"):
-                    if "HostName" in row:
-                        res = row.replace("HostName", "").strip()
-                        res = "\033[31m" + res + "\033[0m"
+            for row in sshconfigs.get(name, "").split("\n"):
+                if "HostName" in row:
+                    res = row.replace("HostName", "").strip()
+                    res = "\033[31m" + res + "\033[0m"
 
-                result = remote_cmd(name + '.a8.nl', 'cat /etc/os-release|grep VERSION_ID', username="core", keypath=get_keypaths())
+            # os version and the systemd units in one exec, separated by STATUS_SPLIT
+            statuscmd = "cat /etc/os-release|grep VERSION_ID; echo '" + STATUS_SPLIT + "'; " + SYSTEMCTL_UNITS_CMD
 
-                if len(result.strip()) > 0:
-                    res = " ".join([name, res.strip()])
-                    res = " ".join([res, "up", result.lower().strip()])
-                    info(commandline.command, colorize_for_print(res))
-                    print_ctl_cmd(name, "systemctl list-units | sed 's/loaded//' | sed 's/LOAD  //' | sed 's/[\d128-\d255]//g'", ["kube", "docker", "flannel", "etcd", "fleet", "setup-network-environment"])
-                else:
-                    print(colorize_for_print(name + " down"))
+            try:
+                result = get_remote_session(name + '.a8.nl', "core", keypaths).run(statuscmd)
+            except (socket.error, paramiko.SSHException):
+                result = ""
+
+            result, _, units = result.partition(STATUS_SPLIT)
+            return name, res, result, units
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(SSH_WORKERS, len(vmnames))) as executor:
+            probes = list(executor.map(probe_host, vmnames))
+
+        for cnt, (name, res, result, units) in enumerate(probes):
+            if len(result.strip()) > 0:
+                res = " ".join([name, res.strip()])
+                res = " ".join([res, "up", result.lower().strip()])
+                info(commandline.command, colorize_for_print(res))
+                print_ctl_cmd(SYSTEMCTL_UNITS_CMD, units, ["kube", "docker", "flannel", "etcd", "fleet", "setup-network-environment"])
+            else:
+                print(colorize_for_print(name + " down"))
 
-                if cnt < len(vmnames) - 1:
-                    print()
-            except subprocess.CalledProcessError as cpex:
-                console_exception(cpex)
+            if cnt < len(vmnames) - 1:
+                print()
     else:
         cmd_run("vagrant status")
 
@@ -925,19 +1125,23 @@ def cmd_up(commandline, provider):
     @return: None
     """
     curr_gw = get_default_gateway()
-    config_gw = open("config/gateway.txt").read()
+    config_gw = cat("config/gateway.txt")
     if curr_gw.strip() != config_gw.strip():
         cmd_reset(commandline)
 
     if provider is None:
         raise AssertionError("provider is None")
 
-    p = subprocess.Popen(["python", "-m", "SimpleHTTPServer", "8000"], stdout=open("/dev/null", "w"), stderr=open("/dev/null", "w"))
+    httpserver = None
+
+    if needs_http_server():
+        httpserver = start_http_server()
+
     try:
         cmd = "vagrant up --provider=" + provider
         cmd_run(cmd)
     finally:
-        p.kill()
+        stop_http_server(httpserver)
 
 
 def cmd_version(commandline, kubectl):
@@ -954,8 +1158,8 @@ def cmd_version(commandline, kubectl):
     if "version.Info" in rv:
         for rv in rv.split("\n"):
             rvs = rv.split("version.Info")
-            jc = rvs[1]
-            jc = jc.replace("{", "{'").replace(":", "':").replace(", ", ", '").replace("'", '"').strip().replace(" ", "")
+            # version.Info{Major:"0", GitVersion:"v0.15.0"} -> json by quoting the keys
+            jc = VERSION_INFO_KEY_RE.sub(r'\1"\2":', rvs[1].strip())
             version = json.loads(jc)
             info(commandline.projectname + " " + rvs[0].lower().strip().strip(":"), version["GitVersion"])
     else:
@@ -999,9 +1203,7 @@ def configure_generic_cluster_files_for_this_machine(commandline, gui, numinstan
     os.chdir(str(commandline.workingdir))
     picklepath = os.path.join(str(commandline.workingdir), ".cl")
 
-    if not os.path.exists(picklepath):
-        os.mkdir(picklepath)
-
+    os.makedirs(picklepath, exist_ok=True)
     vagrantfile = os.path.join(str(commandline.workingdir), "Vagrantfile")
 
     if not path.exists(vagrantfile + ".tpl.rb"):
@@ -1009,9 +1211,6 @@ def configure_generic_cluster_files_for_this_machine(commandline, gui, numinstan
 
         raise SystemExit()
 
-    if not path.exists(picklepath):
-        os.mkdir(picklepath)
-
     func_extra_config = None
     vagranthome = commandline.workingdir
     mod_extra_config_path = path.join(str(vagranthome), "extra_config_vagrant.py")
@@ -1027,19 +1226,17 @@ def configure_generic_cluster_files_for_this_machine(commandline, gui, numinstan
     vmhost, provider = prepare_config(func_extra_config)
     info(commandline.command, provider)
     if commandline.command in ["createproject", "baseprovision", "reset", "reload", "command"]:
-        vfp = open(vagrantfile)
-        vf = vfp.read()
-
-        vfp.close()
-        vf = vf.replace("cpus = x", "cpus = " + str(numcpu))
-        vf = vf.replace("cpus = x", "cpus = " + str(numcpu))
-        vf = vf.replace("$num_instances = x", "$num_instances = " + str(numinstance))
-        vf = vf.replace("$update_channel = 'beta'", "$update_channel = 'alpha'")
-        vf = vf.replace("$vm_gui = x", "$vm_gui = " + str(gui).lower())
-        vf = vf.replace("$vm_memory = x", "$vm_memory = " + str(memory))
-        vf = vf.replace("$vm_cpus = x", "$vm_cpus = " + str(numcpu))
-
-        open(vagrantfile, "w").write(vf)
+        vf = cat(vagrantfile)
+        values = {"cpus = x": "cpus = " + str(numcpu),
+                  "$num_instances = x": "$num_instances = " + str(numinstance),
+                  "$update_channel = 'beta'": "$update_channel = 'alpha'",
+                  "$vm_gui = x": "$vm_gui = " + str(gui).lower(),
+                  "$vm_memory = x": "$vm_memory = " + str(memory),
+                  "$vm_cpus = x": "$vm_cpus = " + str(numcpu)}
+
+        vf = replace_tokens(vf, values)
+
+        to_file(vagrantfile, vf)
         ntl = "configscripts/node.tmpl.yml"
         write_config_from_template(commandline, ntl, vmhost, memory, numcpu)
         ntl = "configscripts/master.tmpl.yml"
@@ -1060,11 +1257,40 @@ def cp(fpathin, fpathout):
     shutil.copyfile(fpathin, fpathout)
 
 
+def discovery_get(url):
+    """
+    GET on discovery.etcd.io over a connection that is kept open for the whole run
+    @type url: str
+    @return: tuple (status, body)
+    """
+    conn = DISCOVERY_CONNECTIONS.get("discovery.etcd.io")
+
+    if conn is None:
+        conn = DISCOVERY_CONNECTIONS["discovery.etcd.io"] = http.client.HTTPSConnection("discovery.etcd.io", timeout=30)
+
+    while True:
+        reused = conn.sock is not None
+
+        try:
+            conn.request("GET", url)
+            response = conn.getresponse()
+            return response.status, response.read().decode("utf-8")
+        except (http.client.HTTPException, OSError) as ex:
+            # a closed connection reconnects on the next request
+            conn.close()
+
+            # the server may drop an idle kept-alive connection, retry that once on a fresh one
+            if not reused or not isinstance(ex, (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)):
+                raise
+
+
 def download_and_unzip_vckuberant_project(commandline):
     """
     @type commandline: VagrantArguments
     @return: None
     """
+    import zipfile
+
     info(commandline.command, "downloading latest version of k8s/coreos for vagrant")
     zippath = os.path.join(os.getcwd(), "master.zip")
     zippathroot = os.path.join(os.path.dirname(os.getcwd()), "master.zip")
@@ -1097,6 +1323,35 @@ def download_and_unzip_vckuberant_project(commandline):
                 raise SystemExit()
 
 
+def download_stream(url, fpath, timeout=60):
+    """
+    Download in 64KB chunks to a temporary file which replaces fpath when
+    complete, an interrupted download never leaves a partial fpath
+    @type url: str
+    @type fpath: str
+    @type timeout: int
+    @return: str (sha256 hexdigest)
+    """
+    sha = hashlib.sha256()
+    tmppath = fpath + ".download"
+
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response, open(tmppath, "wb") as f:
+            for chunk in iter(lambda: response.read(64 * 1024), b""):
+                sha.update(chunk)
+                f.write(chunk)
+
+        os.replace(tmppath, fpath)
+    except BaseException:
+        # also on KeyboardInterrupt, the partial download is of no use
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+
+        raise
+
+    return sha.hexdigest()
+
+
 def echo(content, fpathout):
     """
     @type content: str
@@ -1120,7 +1375,7 @@ def ensure_project_folder(commandline, name, deletefiles):
         abort(commandline.command, "workdir path is file")
 
         raise SystemExit()
-    elif not len(os.listdir(name)) == 0:
+    elif not is_empty_dir(name):
         if deletefiles is False:
             abort(commandline.command, "path not empty")
 
@@ -1128,12 +1383,54 @@ def ensure_project_folder(commandline, name, deletefiles):
         else:
             delete_directory(name, [])
 
-    if not len(os.listdir(name)) == 0:
+    if not is_empty_dir(name):
         abort(commandline.command, "path not empty", stack=True)
 
         raise SystemExit()
 
 
+def ensure_ssh_controlmaster(vmnames):
+    """
+    ssh options for a multiplexed (ControlMaster) connection per machine, the master
+    connections are opened here and later ssh calls reuse them, passed as options so
+    ~/.ssh/config and /etc/ssh/ssh_config stay in effect
+    @type vmnames: list
+    @return: str
+    """
+    options = ["-o ConnectTimeout=5",
+               "-o ControlMaster=auto",
+               "-o " + shlex.quote("ControlPath=~/.ssh/vckube-%r@%h:%p"),
+               "-o ControlPersist=600s"]
+
+    for keypath in get_keypaths():
+        options.append("-i " + shlex.quote(keypath))
+
+    sshoptions = " ".join(options)
+
+    for name in vmnames:
+        host = "core@" + name + ".a8.nl"
+
+        if shell("ssh " + sshoptions + " -O check " + host + " 2> /dev/null") != 0:
+            shell("ssh " + sshoptions + " -fN " + host)
+
+    return sshoptions
+
+
+def ensure_ssh_key(keypath):
+    """
+    ssh-add the key, once per run
+    @type keypath: str
+    @return: None
+    """
+    if keypath in SSH_KEYS_ADDED:
+        return
+    try:
+        cmd_run("ssh-add " + keypath)
+        SSH_KEYS_ADDED.add(keypath)
+    except BaseException as ex:
+        console(ex)
+
+
 def generate_keypair(cmdname, comment, privatekeypath):
     """
     @type cmdname: str
@@ -1154,6 +1451,8 @@ def get_default_gateway():
     """
     get_default_gateway
     """
+    import netifaces
+
     default_gateway = None
     gateways = netifaces.gateways()
 
@@ -1169,7 +1468,8 @@ def get_default_gateway():
 
 def get_keypaths():
     """
-    get_keypaths
+    get_keypaths, not cached: depends on the working directory and
+    baseprovision generates the secure key halfway through a run
     """
     relp = ["keys/secure/vagrantsecure", "keys/insecure/vagrant"]
     pathrs = [os.path.join(os.getcwd(), x) for x in relp]
@@ -1177,13 +1477,62 @@ def get_keypaths():
     return paths
 
 
+def get_kubectl(commandline):
+    """
+    Path of the kubectl binary for this platform, downloaded and made
+    executable on first use, remembered per working directory
+    @type commandline: VagrantArguments
+    @return: str
+    """
+    if commandline.workingdir in KUBECTL_PATHS:
+        return KUBECTL_PATHS[commandline.workingdir]
+
+    machine = platform.machine()
+
+    if "64" in str(machine):
+        machine = "amd64"
+    else:
+        machine = "386"
+
+    system = platform.system()
+    kubectl = os.path.join(commandline.workingdir, "platforms")
+    kubectl = os.path.join(kubectl, system.lower())
+    kubectl = os.path.join(kubectl, machine)
+    kubectl = os.path.join(kubectl, "kubectl")
+
+    if not os.access(kubectl, os.X_OK):
+        if not os.path.exists(kubectl):
+            os.makedirs(os.path.dirname(kubectl), exist_ok=True)
+            url = "https://storage.googleapis.com/kubernetes-release/release/v0.15.0/bin/" + system.lower() + "/" + machine + "/kubectl"
+            info("cmd_kubectl:download", url)
+
+            try:
+                info("cmd_kubectl:sha256", download_stream(url, kubectl))
+            except OSError as ex:
+                # URLError and socket.timeout are OSErrors
+                abort(commandline.command, "kubectl not found: " + str(kubectl) + ", download failed: " + str(ex))
+
+        if not os.path.exists(kubectl):
+            abort(commandline.command, "kubectl not found: " + str(kubectl))
+
+        if not os.access(kubectl, os.X_OK):
+            info("cmd_kubectl:chmod:exec", kubectl)
+            os.chmod(kubectl, stat.S_IREAD | stat.S_IWRITE | stat.S_IEXEC)
+
+    KUBECTL_PATHS[commandline.workingdir] = kubectl
+    return kubectl
+
+
 def get_num_instances():
     """
-    get_num_instances
+    @return: int, None when the Vagrantfile does not set num_instances
     """
-    v = open("Vagrantfile").read()
-    numinstances = int(v[v.find("num_instances") + (v[v.find("num_instances"):].find("=")):].split("\n")[0].replace("=", "").strip())
-    return numinstances
+    m = NUM_INSTANCES_RE.search(cat("Vagrantfile"))
+
+    if m is None:
+        return None
+
+    return int(m.group(1))
 
 
 def get_provider():
@@ -1198,102 +1547,212 @@ def get_provider():
     return provider
 
 
+def get_remote_session(server, username="core", keypath=None):
+    """
+    Pooled RemoteSession, connections are shared within one run
+    @type server: str
+    @type username: str
+    @type keypath: list, str, None
+    @return: RemoteSession
+    """
+    if isinstance(keypath, list):
+        key = (server, username, tuple(keypath))
+    else:
+        key = (server, username, keypath)
+
+    with REMOTE_SESSIONS_LOCK:
+        if len(REMOTE_SESSIONS) == 0:
+            atexit.register(close_remote_sessions)
+
+        if key not in REMOTE_SESSIONS:
+            REMOTE_SESSIONS[key] = RemoteSession(server, username, keypath)
+
+        return REMOTE_SESSIONS[key]
+
+
+def get_ssh_configs(commandline, vmnames):
+    """
+    vagrant ssh-config output per machine, one vagrant call for all machines, machines
+    without output get "", cached in .vckube/ssh-config.cache until the Vagrantfile or
+    the .vagrant folder changes
+    @type commandline: VagrantArguments
+    @type vmnames: list
+    @return: dict
+    """
+    cachepath = os.path.join(str(commandline.workingdir), ".vckube/ssh-config.cache")
+    configs = {}
+
+    if os.path.exists(cachepath):
+        cachemtime = os.stat(cachepath).st_mtime
+        dependencies = [os.path.join(str(commandline.workingdir), x) for x in ["Vagrantfile", ".vagrant", ".vagrant/machines"]]
+
+        if all(cachemtime >= os.stat(x).st_mtime for x in dependencies if os.path.exists(x)):
+            with open(cachepath) as f:
+                configs = json.load(f)
+
+    if all(name in configs for name in vmnames):
+        return configs
+
+    try:
+        # vagrant exits with an error when a machine is not created, the output for the others is still usable
+        proc = subprocess.run(["vagrant", "ssh-config"], cwd=str(commandline.workingdir), stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    except FileNotFoundError:
+        warning(commandline.command, "vagrant not found")
+        return dict(configs, **{name: "" for name in vmnames if name not in configs})
+
+    for block in SSH_CONFIG_HOST_RE.split(proc.stdout):
+        block = block.strip()
+
+        if len(block) > 0:
+            configs[block.split()[0]] = "Host " + block
+
+    # machines that are not created print no block, remember them so a warm cache needs no vagrant call
+    for name in vmnames:
+        configs.setdefault(name, "")
+
+    os.makedirs(os.path.dirname(cachepath), exist_ok=True)
+    tmppath = cachepath + ".tmp"
+
+    with open(tmppath, "w") as f:
+        json.dump(configs, f)
+
+    os.replace(tmppath, cachepath)
+    return configs
+
+
 def get_token():
     """
     get_token
     """
-    token = os.popen("curl -s https://discovery.etcd.io/new?size=1").read()
+    url = "/new?size=1"
     cnt = 0
 
-    while "Unable" in token:
+    while True:
+        try:
+            status, token = discovery_get(url)
+        except (http.client.HTTPException, OSError) as ex:
+            status, token = None, str(ex)
+
+        if status == 200:
+            return token
+
         if cnt > 3:
             raise AssertionError("could not fetch token")
 
         time.sleep(1)
-        token = os.popen("curl -s https://discovery.etcd.io/new?size=3").read()
+        url = "/new?size=3"
         cnt += 1
 
-    return token
+
+def get_vagrant_vm_configs():
+    """
+    [vmname, sshconfig] for every machine in vagrant status
+    @return: list
+    """
+    import vagrant
+
+    statusnames = [vm.name.split()[0].strip() for vm in vagrant.Vagrant().status()]
+
+    def vm_config(vmname):
+        """
+        A Vagrant instance per call, python-vagrant does not document its instances as thread safe
+        @type vmname: str
+        @return: list
+        """
+        v = vagrant.Vagrant()
+        return [vmname, v.conf(v.ssh_config(vm_name=vmname))]
+
+    if len(statusnames) == 0:
+        return []
+
+    # every ssh_config call starts its own vagrant process
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(8, len(statusnames))) as executor:
+        return list(executor.map(vm_config, statusnames))
 
 
 def get_vm_configs():
     """
     get_vm_configs
     """
-    cwd = os.getcwd()
-    picklepath = os.path.join(cwd, ".cl/vmnames.pickle")
-    get_vm_names()
-    result = [x[1] for x in pickle.load(open(picklepath)) if x[1] is not None]
+    vmnamespath = os.path.join(os.getcwd(), ".cl/vmnames.json")
+    result = [x[1] for x in get_vm_entries() if x[1] is not None]
 
     if len(result) > 0:
         return result
     else:
-        v = vagrant.Vagrant()
-        status = v.status()
-        vmnames = []
-
-        for vm in status:
-            vmname = vm.name.split()[0].strip()
-            vmnames.append([vmname, v.conf(v.ssh_config(vm_name=vmname))])
+        vmnames = get_vagrant_vm_configs()
 
         if len(vmnames) > 0:
-            picklepath = os.path.join(cwd, ".cl/vmnames.pickle")
-            pickle.dump(vmnames, open(picklepath, "wb"))
+            vmnames_save(vmnamespath, vmnames)
 
         return [x[1] for x in vmnames if x[1] is not None]
 
 
-def get_vm_names(retry=False):
+def get_vm_entries(retry=False):
     """
-    @type retry: str, unicode
-    @return: None
+    [vmname, sshconfig] per machine as stored in .cl/vmnames.json, created when missing
+    @type retry: bool
+    @return: list
     """
     try:
         cwd = os.getcwd()
         cldir = os.path.join(cwd, ".cl")
 
-        if not os.path.exists(cldir):
-            os.mkdir(cldir)
+        os.makedirs(cldir, exist_ok=True)
 
-        picklepath = os.path.join(cwd, ".cl/vmnames.pickle")
+        vmnamespath = os.path.join(cwd, ".cl/vmnames.json")
 
         if not os.path.exists(os.path.join(cwd, "Vagrantfile")):
             return []
 
-        if path.exists(picklepath):
-            l = sorted([x[0] for x in pickle.load(open(picklepath, "rb"))])
-            return l
+        stored = vmnames_load(vmnamespath)
+
+        if stored is not None:
+            return stored
 
         vmnames = []
         numinstances = get_num_instances()
         osx = is_osx()
 
-        for i in range(1, numinstances + 1):
-            if osx is True:
-                vmnames.append(["core" + str(i), None])
-            else:
-                vmnames.append(["node" + str(i), None])
-
-        if numinstances is None:
-            v = vagrant.Vagrant()
-            status = v.status()
-
-            for vm in status:
-                vmname = vm.name.split()[0].strip()
-                vmnames.append([vmname, v.conf(v.ssh_config(vm_name=vmname))])
+        if numinstances is not None:
+            for i in range(1, numinstances + 1):
+                if osx is True:
+                    vmnames.append(["core" + str(i), None])
+                else:
+                    vmnames.append(["node" + str(i), None])
+        else:
+            vmnames = get_vagrant_vm_configs()
 
         if len(vmnames) > 0:
-            pickle.dump(vmnames, open(picklepath, "wb"))
+            vmnames_save(vmnamespath, vmnames)
 
-        l = sorted([x[0] for x in vmnames])
-        return l
+        return vmnames
     except subprocess.CalledProcessError as ex:
         print(ex)
 
         if retry:
             return []
 
-        return get_vm_names(True)
+        return get_vm_entries(True)
+
+
+def get_vm_names():
+    """
+    @return: list
+    """
+    return sorted([x[0] for x in get_vm_entries()])
+
+
+def get_vm_names_cached(commandline):
+    """
+    get_vm_names, looked up once per command
+    @type commandline: VagrantArguments
+    @return: list
+    """
+    if commandline.vmnames is None:
+        commandline.vmnames = get_vm_names()
+
+    return commandline.vmnames
 
 
 def get_working_directory(commandline):
@@ -1349,12 +1808,28 @@ def host_osx():
     """
     host_osx
     """
-    vmhostosx = False
+    return IS_DARWIN
+
+
+def hosts_inventory(vmnames, hostips):
+    """
+    ansible inventory, the first vm is the master, the second runs etcd, all but the first are nodes
+    @type vmnames: list
+    @type hostips: list
+    @return: str
+    """
+    hostlines = []
+    names = []
 
-    if str(os.popen("uname -a").read()).startswith("Darwin"):
-        vmhostosx = True
+    for name, hostip in zip(vmnames, hostips):
+        hostlines.append(name + " ansible_ssh_host=" + hostip + " ansible_ssh_port=22\n")
+        names.append(name + "\n")
 
-    return vmhostosx
+    return HOSTS_TEMPLATE.format(hostlines="".join(hostlines),
+                                 masters="".join(names[:1]),
+                                 etcd="".join(names[1:2]),
+                                 nodes="".join(names[1:]),
+                                 names="".join(names))
 
 
 def input_vagrant_parameters(commandline, numcpus=8, gui=False, instances=3, memory=2048, confirmed=False, deleteoldfiles=False):
@@ -1376,7 +1851,7 @@ def input_vagrant_parameters(commandline, numcpus=8, gui=False, instances=3, mem
             fp = os.path.join(os.getcwd(), name)
 
             if os.path.exists(fp):
-                if len(os.listdir(fp)) > 0:
+                if not is_empty_dir(fp):
                     deleteoldfiles = query_yes_no(["force delete all files in directory:", fp], default=deleteoldfiles, force=commandline.force)
 
             numcpus = doinput("cpus per instance", default=numcpus, force=commandline.force)
@@ -1415,16 +1890,21 @@ def input_vagrant_parameters(commandline, numcpus=8, gui=False, instances=3, mem
     return gui, instances, memory, numcpus, name, deleteoldfiles
 
 
-def is_osx():
+def is_empty_dir(dpath):
     """
-    is_osx
+    Stops at the first entry instead of listing the whole directory
+    @type dpath: str
+    @return: bool
     """
-    osx = False
+    with os.scandir(dpath) as entries:
+        return next(entries, None) is None
 
-    if str(os.popen("uname -a").read()).startswith("Darwin"):
-        osx = True
 
-    return osx
+def is_osx():
+    """
+    is_osx
+    """
+    return IS_DARWIN
 
 
 def localize_config(commandline, vmhostosx):
@@ -1436,68 +1916,25 @@ def localize_config(commandline, vmhostosx):
     cmd_run('rm -Rf ".cl"')
     cmd_run('rm -Rf "hosts"')
 
-    if not os.path.exists(".cl"):
-        os.mkdir(".cl")
+    os.makedirs(".cl", exist_ok=True)
 
     if vmhostosx is True:
         info(commandline.command, "Localized for OSX")
     else:
         info(commandline.command, "Localized for Linux")
 
-    hosts = open("hosts", "w")
-
     # for cf in get_vm_configs():
     # hosts.write(cf["Host"] + " ansible_ssh_host=" + cf["HostName"] + " ansible_ssh_port=22\n")
-    vmnames = get_vm_names()
-
-    for name in vmnames:
-        try:
-            hostip = str(socket.gethostbyname(name + ".a8.nl"))
-            hosts.write(name + " ansible_ssh_host=" + hostip + " ansible_ssh_port=22\n")
-        except socket.gaierror:
-            hosts.write(name + " ansible_ssh_host=" + name + ".a8.nl ansible_ssh_port=22\n")
-
-    hosts.write("\n[masters]\n")
-
-    for name in vmnames:
-        hosts.write(name + "\n")
-        break
+    commandline.vmnames = None
+    vmnames = get_vm_names_cached(commandline)
 
-    cnt = 0
-    hosts.write("\n[etcd]\n")
-
-    for name in vmnames:
-        if cnt == 1:
-            hosts.write(name + "\n")
-
-        cnt += 1
-
-    cnt = 0
-    hosts.write("\n[nodes]\n")
-
-    for name in vmnames:
-        if cnt > 0:
-            hosts.write(name + "\n")
-
-        cnt += 1
-
-    hosts.write("\n[all]\n")
-
-    for name in vmnames:
-        hosts.write(name + "\n")
-
-    hosts.write("\n[all_groups:children]\nmasters\netcd\nnodes\n")
-    hosts.write("\n[coreos]\n")
-
-    for name in vmnames:
-        hosts.write(name + "\n")
-
-    hosts.write("\n[coreos:vars]\n")
-    hosts.write("ansible_ssh_user=core\n")
-    hosts.write("ansible_python_interpreter=\"PATH=/home/core/bin:$PATH python\"\n")
+    if len(vmnames) > 0:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(16, len(vmnames))) as executor:
+            hostips = list(executor.map(resolve_host, [name + ".a8.nl" for name in vmnames]))
+    else:
+        hostips = []
 
-    hosts.flush()
-    hosts.close()
+    to_file("hosts", hosts_inventory(vmnames, hostips))
     cwd = os.getcwd()
     ntl = os.path.join(cwd, "configscripts/node.tmpl.yml")
 
@@ -1525,6 +1962,18 @@ def main():
         info("main", "bye")
 
 
+def needs_http_server():
+    """
+    True when the Vagrantfile or the cloud-configs fetch files from the http server on port 8000
+    @return: bool
+    """
+    for fpath in ("Vagrantfile", "configscripts/node.yml", "configscripts/master.yml"):
+        if os.path.exists(fpath) and ":8000" in cat(fpath):
+            return True
+
+    return False
+
+
 def prepare_config(func_extra_config=None):
     """
     @type func_extra_config: str, unicode, None
@@ -1587,17 +2036,17 @@ def print_config(commandline, deleteoldfiles, gui, instances, memory, name, numc
         groupinfo.add("memory per instance", str(memory))
 
 
-def print_ctl_cmd(name, systemcmd, shouldhaveword):
+def print_ctl_cmd(systemcmd, output, shouldhaveword):
     """
-    @type name: str
     @type systemcmd: str
+    @type output: str
     @type shouldhaveword: list
     @return: None
     """
     kunits = set()
     header = None
 
-    for line in remote_cmd(name + '.a8.nl', systemcmd, "core", keypath=get_keypaths()).split("\n"):
+    for line in output.split("\n"):
         if header is None:
             header = line
 
@@ -1618,6 +2067,27 @@ def print_ctl_cmd(name, systemcmd, shouldhaveword):
             groupinfo.add(service[0], " ".join(service[1:]))
 
 
+def replace_tokens(text, values):
+    """
+    Replace every key of values in text with its value, in a single pass
+    @type text: str
+    @type values: dict
+    @return: str
+    """
+    return token_pattern(tuple(sorted(values))).sub(lambda m: values[m.group(0)], text)
+
+
+def resolve_host(fqdn):
+    """
+    @type fqdn: str
+    @return: str ip address, or the name itself when it does not resolve
+    """
+    try:
+        return str(socket.gethostbyname(fqdn))
+    except socket.gaierror:
+        return fqdn
+
+
 def run_commandline(parent=None):
     """
     @type parent: Arguments, None
@@ -1627,6 +2097,29 @@ def run_commandline(parent=None):
     cmd_driver_vagrant(commandline)
 
 
+def run_parallel(cmds, max_workers=8):
+    """
+    Run shell commands concurrently, via subprocess because cmd_run and cmd_exec clean up
+    the callcommand_* files of other calls in the working directory and are not thread safe
+    @type cmds: list
+    @type max_workers: int
+    @return: list of (returncode, output) in the order of cmds
+    """
+    if len(cmds) == 0:
+        return []
+
+    def run(cmd):
+        """
+        @type cmd: str
+        @return: tuple
+        """
+        proc = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+        return proc.returncode, proc.stdout.rstrip()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(cmds))) as executor:
+        return list(executor.map(run, cmds))
+
+
 def sed(oldstr, newstr, infile):
     """
     @type oldstr: str
@@ -1634,18 +2127,26 @@ def sed(oldstr, newstr, infile):
     @type infile: str
     @return: None
     """
-    linelist = []
+    data = cat(infile)
+
+    if oldstr and "\n" not in oldstr and re.escape(oldstr) == oldstr and "\\" not in newstr:
+        # no regex metacharacters and no backreferences, plain replace is faster
+        data = data.replace(oldstr, newstr)
+    else:
+        pattern = sed_pattern(oldstr)
+        data = "".join(pattern.sub(newstr, line) for line in data.splitlines(True))
 
-    with open(infile) as f:
-        for item in f:
-            newitem = re.sub(oldstr, newstr, item)
-            linelist.append(newitem)
+    to_file(infile, data)
 
-    with open(infile, "w") as f:
-        f.truncate()
 
-        for line in linelist:
-            f.writelines(line)
+@functools.lru_cache(maxsize=64)
+def sed_pattern(oldstr):
+    """
+    sed regex, compiled once per pattern
+    @type oldstr: str
+    @return: re.Pattern
+    """
+    return re.compile(oldstr)
 
 
 def set_gateway_and_coreostoken(commandline):
@@ -1707,6 +2208,45 @@ def set_working_dir(commandline, projectname):
     return commandline
 
 
+def start_http_server(port=8000):
+    """
+    Serve the working directory in a daemon thread, the vms download provisioning files from it
+    @type port: int
+    @return: ThreadingHTTPServer, None when the port is already in use
+    """
+    class QuietHandler(http.server.SimpleHTTPRequestHandler):
+        """
+        SimpleHTTPRequestHandler without the request log on stderr
+        """
+        def log_message(self, *args):
+            """
+            @type args: tuple
+            @return: None
+            """
+            pass
+
+    handler = functools.partial(QuietHandler, directory=os.getcwd())
+
+    try:
+        server = http.server.ThreadingHTTPServer(("", port), handler)
+    except OSError as ex:
+        warning("http server", "port " + str(port) + ": " + str(ex))
+        return None
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stop_http_server(server):
+    """
+    @type server: ThreadingHTTPServer, None
+    @return: None
+    """
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+
+
 def to_file(fpath, txt, mode="wt"):
     """
     @type fpath: str
@@ -1718,11 +2258,24 @@ def to_file(fpath, txt, mode="wt"):
         f.write(txt)
 
 
+@functools.lru_cache(maxsize=16)
+def token_pattern(tokens):
+    """
+    Compiled alternation of the literal tokens, longest first so a token
+    that is a prefix of another one does not win
+    @type tokens: tuple
+    @return: re.Pattern
+    """
+    return re.compile("|".join(re.escape(x) for x in sorted(tokens, key=len, reverse=True)))
+
+
 def unzip(source_filename):
     """
     @type source_filename: str
     @return: None
     """
+    import zipfile
+
     dest_dir = os.getcwd()
     zippath = os.path.join(dest_dir, source_filename)
 
@@ -1731,22 +2284,82 @@ def unzip(source_filename):
 
         raise FileNotFoundError(zippath)
 
+    # the archive holds one top level folder, its contents are written straight into dest_dir
+    prefix = "vckube-createproject-master/"
+    extracted_dir = os.path.join(dest_dir, "vckube-createproject-master")
+    realdest = os.path.realpath(dest_dir)
+
     with zipfile.ZipFile(zippath) as zf:
-        zf.extractall(dest_dir)
+        zinfos = zf.infolist()
 
-    extracted_dir = os.path.join(os.path.join(os.getcwd(), dest_dir), "vckube-createproject-master")
+        if not any(zinfo.filename.startswith(prefix) for zinfo in zinfos):
+            console_warning(extracted_dir + " not created")
 
-    if os.path.exists(extracted_dir):
-        for mdir in os.listdir(extracted_dir):
-            shutil.move(os.path.join(extracted_dir, mdir), dest_dir)
+            raise FileExistsError(extracted_dir + " not created")
 
-        os.rmdir(extracted_dir)
+        targets = []
 
-        # os.remove(os.path.join(os.getcwd(), os.path.join(dest_dir, "master.zip")))
-    else:
-        console_warning(extracted_dir + " not created")
+        # every entry is checked before anything is written, a bad archive leaves no partial extraction
+        for zinfo in zinfos:
+            relpath = zinfo.filename
 
-        raise FileExistsError(extracted_dir + " not created")
+            if relpath.startswith(prefix):
+                relpath = relpath[len(prefix):]
+
+            if relpath == "":
+                continue
+
+            target = os.path.realpath(os.path.join(realdest, relpath))
+
+            if os.path.commonpath([realdest, target]) != realdest:
+                raise AssertionError("zipfile entry outside of " + dest_dir + ": " + zinfo.filename)
+
+            targets.append((zinfo, target))
+
+        for zinfo, target in targets:
+            if zinfo.is_dir():
+                os.makedirs(target, exist_ok=True)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+
+                with zf.open(zinfo) as fin, open(target, "wb") as fout:
+                    shutil.copyfileobj(fin, fout, 1024 * 1024)
+
+
+def vmnames_load(vmnamespath):
+    """
+    Read the stored [vmname, sshconfig] list, served from VMNAMES_CACHE while the file is unchanged
+    @type vmnamespath: str
+    @return: list, None when nothing is stored yet
+    """
+    try:
+        st = os.stat(vmnamespath)
+    except FileNotFoundError:
+        return None
+
+    key = (st.st_mtime_ns, st.st_size)
+    cached = VMNAMES_CACHE.get(vmnamespath)
+
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    with open(vmnamespath) as f:
+        vmnames = json.load(f)
+
+    VMNAMES_CACHE[vmnamespath] = (key, vmnames)
+    return vmnames
+
+
+def vmnames_save(vmnamespath, vmnames):
+    """
+    @type vmnamespath: str
+    @type vmnames: list
+    @return: None
+    """
+    with open(vmnamespath, "w") as f:
+        json.dump(vmnames, f)
+
+    VMNAMES_CACHE.pop(vmnamespath, None)
 
 
 def write_config_from_template(commandline, ntl, vmhostosx, memory, cpus):
@@ -1758,30 +2371,28 @@ def write_config_from_template(commandline, ntl, vmhostosx, memory, cpus):
     @type cpus: int
     @return: None
     """
-    node = open(ntl).read()
-    node = node.replace("<cloud-provider>", "vagrant")
-
     if vmhostosx:
         masterip = "192.168.14.41"
-        node = node.replace("<master-private-ip>", masterip)
-        node = node.replace("<name-node>", "core1.a8.nl")
+        namenode = "core1.a8.nl"
     else:
         masterip = "192.168.14.51"
-        node = node.replace("<master-private-ip>", masterip)
-        node = node.replace("<name-node>", "node1.a8.nl")
+        namenode = "node1.a8.nl"
 
     if memory is None or cpus is None:
         raise RuntimeError("memory is None")
 
-    node = node.replace("<node-memory>", str(memory))
+    values = {"<cloud-provider>": "vagrant",
+              "<master-private-ip>": masterip,
+              "<name-node>": namenode,
+              "<node-memory>": str(memory),
+              "<node-cpus>": str(cpus)}
 
-    if cpus is not None:
-        node = node.replace("<node-cpus>", str(cpus))
+    node = replace_tokens(cat_cached(ntl), values)
 
     info(commandline.command, "master-private-ip: " + masterip)
     config = ntl.replace(".tmpl", "")
     info(commandline.command, "writing: " + config)
-    open(config, "w").write(node)
+    to_file(config, node)
 
 
 def write_new_tokens(vmhostosx):
@@ -1799,19 +2410,17 @@ def write_new_tokens(vmhostosx):
         cwd = os.getcwd()
         configpath = os.path.join(cwd, "config")
 
-        if not os.path.exists(configpath):
-            os.mkdir(configpath)
-
+        os.makedirs(configpath, exist_ok=True)
         path2 = os.path.join(cwd, "config/token" + arch + ".txt")
         return path2
 
     if vmhostosx is True:
         tposx = tokenpath("osx")
-        open(tposx, "w").write(token)
+        to_file(tposx, token)
         cp("./config/tokenosx.txt", "./config/token.txt")
     else:
         tlin = tokenpath("linux")
-        open(tlin, "w").write(token)
+        to_file(tlin, token)
         cp("./config/tokenlinux.txt", "./config/token.txt")
 
 